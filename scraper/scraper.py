@@ -1,22 +1,35 @@
 import requests
-from bs4 import BeautifulSoup
-import json
+from requests.adapters import HTTPAdapter
+from selectolax.lexbor import LexborHTMLParser
+import orjson
 import random
 import time
 import logging
+import logging.handlers
 from datetime import datetime, timedelta
-import schedule
 import sys
 import os
 import re
+import functools
+import hashlib
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from threading import Semaphore
 from urllib.parse import urlparse, parse_qs
 
 # Configuración de logging
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# El archivo de log se escribe por lotes para no hacer una escritura a disco por cada mensaje
+# (el formato se aplica en el FileHandler, que es quien emite los registros acumulados)
+FILE_HANDLER = logging.FileHandler("scraper/scraper.log")
+FILE_HANDLER.setFormatter(logging.Formatter(LOG_FORMAT))
+BUFFERED_FILE_HANDLER = logging.handlers.MemoryHandler(capacity=512, target=FILE_HANDLER)
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format=LOG_FORMAT,
     handlers=[
-        logging.FileHandler("scraper/scraper.log"),
+        BUFFERED_FILE_HANDLER,
         logging.StreamHandler(sys.stdout)
     ]
 )
@@ -31,49 +44,83 @@ USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Edge/123.0.0.0 Safari/537.36"
 ]
 
+# Headers HTTP realistas comunes a todas las peticiones
+BASE_HEADERS = {
+    "Accept-Language": "es-MX,es;q=0.9,en;q=0.8",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8",
+    "Accept-Encoding": "gzip, deflate, br",
+    "Connection": "keep-alive",
+    "Upgrade-Insecure-Requests": "1",
+    "Cache-Control": "max-age=0",
+    "Referer": "https://www.mercadolibre.com.mx/",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "same-origin",
+    "Sec-Fetch-User": "?1"
+}
+
+# Sesión compartida para reutilizar conexiones (keep-alive) entre peticiones.
+# Sin reintentos en el adapter: fetch_with_retries ya reintenta los listados y
+# la resolución de redirecciones debe fallar rápido hacia la URL genérica.
+SESSION = requests.Session()
+SESSION.headers.update(BASE_HEADERS)
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=0
+))
+
+# Headers por User-Agent precalculados; requests los combina con los de la sesión sin modificarlos
+USER_AGENT_HEADERS = tuple({"User-Agent": user_agent} for user_agent in USER_AGENTS)
+
 def get_random_headers():
-    """Genera headers HTTP aleatorios y realistas para evitar detección"""
-    return {
-        "User-Agent": random.choice(USER_AGENTS),
-        "Accept-Language": "es-MX,es;q=0.9,en;q=0.8",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8",
-        "Accept-Encoding": "gzip, deflate, br",
-        "Connection": "keep-alive",
-        "Upgrade-Insecure-Requests": "1",
-        "Cache-Control": "max-age=0",
-        "Referer": "https://www.mercadolibre.com.mx/",
-        "Sec-Fetch-Dest": "document",
-        "Sec-Fetch-Mode": "navigate",
-        "Sec-Fetch-Site": "same-origin",
-        "Sec-Fetch-User": "?1"
-    }
+    """Devuelve un header User-Agent aleatorio para evitar detección (el resto viene de la sesión)"""
+    return random.choice(USER_AGENT_HEADERS)
+
+# Patrones comunes de URLs de Mercado Libre, en orden de prioridad
+PRODUCT_ID_PATTERNS = [
+    re.compile(r'MLA?M(\d+)'),  # Formato MLM12345678
+    re.compile(r'/p/MLA?M(\d+)'),  # Formato /p/MLM12345678
+    re.compile(r'-_JM#position=(\d+)'),  # Formato posición en listado
+    re.compile(r'_ID=(\d+)'),  # Formato ID en algunos enlaces
+    re.compile(r'/(\d+)-'),  # Formato numérico en URLs amigables
+]
+
+# Segmento del path completamente numérico y largo (los IDs suelen ser números largos)
+LONG_DIGIT_RE = re.compile(r'(?:^|/)(\d{6,})(?=/|$)')
 
 def extract_product_id(url):
     """Extrae el ID del producto de la URL de Mercado Libre"""
-    # Patrones comunes de URLs de Mercado Libre
-    patterns = [
-        r'MLA?M(\d+)',  # Formato MLM12345678
-        r'/p/MLA?M(\d+)',  # Formato /p/MLM12345678
-        r'-_JM#position=(\d+)',  # Formato posición en listado
-        r'_ID=(\d+)',  # Formato ID en algunos enlaces
-        r'/(\d+)-',  # Formato numérico en URLs amigables
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, url)
+    for pattern in PRODUCT_ID_PATTERNS:
+        match = pattern.search(url)
         if match:
             return match.group(1)
     
     # Si no encontramos un ID con los patrones, intentamos extraerlo del path
     parsed_url = urlparse(url)
-    path_parts = parsed_url.path.split('/')
     
     # Buscamos partes numéricas en el path que podrían ser IDs
-    for part in path_parts:
-        if part.isdigit() and len(part) > 5:  # IDs suelen ser números largos
-            return part
+    match = LONG_DIGIT_RE.search(parsed_url.path)
+    return match.group(1) if match else None
+
+# Códigos con los que un servidor puede rechazar una petición HEAD
+HEAD_REJECTED_STATUS = (403, 405, 501)
+
+@functools.lru_cache(maxsize=4096)
+def resolve_redirect(url):
+    """Sigue las redirecciones de una URL de tracking con HEAD (sin descargar el cuerpo) y devuelve la URL final sin parámetros"""
+    response = SESSION.head(url, headers=get_random_headers(), timeout=10, allow_redirects=True)
     
-    return None
+    # Algunos servidores rechazan HEAD: repetimos con GET en streaming y cerramos sin leer el cuerpo
+    if response.status_code in HEAD_REJECTED_STATUS:
+        with SESSION.get(url, headers=get_random_headers(), timeout=10, allow_redirects=True, stream=True) as response:
+            pass
+    
+    # Lanzamos excepción en lugar de devolver un valor para no cachear fallos temporales
+    if response.status_code != 200:
+        raise requests.HTTPError(f"Código de estado {response.status_code} siguiendo redirección", response=response)
+    
+    return response.url.split("?")[0].split("#")[0]
 
 def clean_product_url(url):
     """Genera una URL limpia para el producto de Mercado Libre"""
@@ -88,6 +135,17 @@ def clean_product_url(url):
         clean_url = clean_url.split("#")[0]
         return clean_url
     
+    # Muchas URLs de tracking incluyen el destino real en el parámetro "url": lo usamos sin peticiones de red
+    embedded_url = parse_qs(urlparse(url).query).get("url", [None])[0]
+    if (
+        embedded_url and embedded_url.startswith("http")
+        and urlparse(embedded_url).netloc.endswith("mercadolibre.com.mx")
+        and "click" not in embedded_url and "mclics" not in embedded_url
+    ):
+        final_url = embedded_url.split("?")[0].split("#")[0]
+        logger.info(f"URL final obtenida del parámetro de tracking: {final_url}")
+        return final_url
+    
     # Para URLs de tracking, intentamos extraer el ID del producto
     product_id = extract_product_id(url)
     
@@ -98,26 +156,22 @@ def clean_product_url(url):
         
         # Intentamos obtener la URL real siguiendo la redirección
         try:
-            session = requests.Session()
-            response = session.get(url, headers=get_random_headers(), timeout=10, allow_redirects=True)
+            final_url = resolve_redirect(url)
             
-            if response.status_code == 200:
-                final_url = response.url.split("?")[0].split("#")[0]
-                
-                # Verificamos que la URL final no sea una URL de tracking
-                if "click" in final_url or "mclics" in final_url:
-                    # Si seguimos en una URL de tracking, usamos una URL genérica
-                    generic_url = f"https://articulo.mercadolibre.com.mx/MLM-{product_id}-item"
-                    logger.info(f"URL final sigue siendo de tracking, usando URL genérica: {generic_url}")
-                    return generic_url
-                
-                logger.info(f"URL final obtenida: {final_url}")
-                return final_url
-            else:
-                # Si falla, construimos una URL genérica
+            # Verificamos que la URL final no sea una URL de tracking
+            if "click" in final_url or "mclics" in final_url:
+                # Si seguimos en una URL de tracking, usamos una URL genérica
                 generic_url = f"https://articulo.mercadolibre.com.mx/MLM-{product_id}-item"
-                logger.info(f"Usando URL genérica: {generic_url}")
+                logger.info(f"URL final sigue siendo de tracking, usando URL genérica: {generic_url}")
                 return generic_url
+            
+            logger.info(f"URL final obtenida: {final_url}")
+            return final_url
+        except requests.HTTPError as e:
+            # Un código de estado distinto de 200 es esperable: usamos la URL genérica sin tratarlo como error
+            generic_url = f"https://articulo.mercadolibre.com.mx/MLM-{product_id}-item"
+            logger.info(f"{str(e)}. Usando URL genérica: {generic_url}")
+            return generic_url
         except Exception as e:
             logger.error(f"Error siguiendo redirección: {str(e)}")
             # Si falla, construimos una URL genérica
@@ -129,20 +183,23 @@ def clean_product_url(url):
     logger.warning(f"No se pudo limpiar la URL: {url}")
     return url.split("?")[0].split("#")[0]
 
+# Sufijos de imagen original que convertimos a la versión WebP
+IMAGE_EXT_RE = re.compile(r'O\.(?:jpg|png)')
+
 def get_real_image_url(img_elem):
     """Obtiene la imagen HD (evita placeholders)"""
     if not img_elem:
         return None
         
     # Intentamos obtener la URL de la imagen, priorizando data-src (carga diferida)
-    url = img_elem.get("data-src") or img_elem.get("src")
+    url = img_elem.attributes.get("data-src") or img_elem.attributes.get("src")
     
     # Verificamos que no sea un placeholder base64
     if not url or url.startswith("data:image"):
         return None
     
     # Convertimos a formato HD WebP
-    hd_url = url.replace("O.jpg", "V.webp").replace("O.png", "V.webp")
+    hd_url = IMAGE_EXT_RE.sub("V.webp", url)
     
     # Añadimos 2X para alta resolución si no existe
     if "2X" not in hd_url and "NP_" in hd_url:
@@ -150,11 +207,15 @@ def get_real_image_url(img_elem):
     
     return hd_url
 
+DIGITS_RE = re.compile(r'\d+')
+
 def extract_number(text):
     """Extrae números de un texto"""
     if not text:
         return 0
-    return int(''.join(filter(str.isdigit, text)) or 0)
+    # Unimos todos los grupos de dígitos para soportar separadores de miles ("1.000 vendidos")
+    digits = DIGITS_RE.findall(text)
+    return int(''.join(digits)) if digits else 0
 
 def extract_category_from_url(url):
     """Extrae la categoría de la URL"""
@@ -172,12 +233,19 @@ def extract_category_from_url(url):
     
     return "tecnologia"  # Categoría por defecto
 
+def write_json_atomic(path, data):
+    """Escribe JSON en un archivo temporal y lo renombra, para no dejar archivos a medio escribir"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
+    os.replace(tmp_path, path)
+
 def load_published_offers():
     """Carga el historial de ofertas publicadas"""
     try:
         if os.path.exists("bot/published_offers.json"):
-            with open("bot/published_offers.json", "r", encoding="utf-8") as f:
-                return json.load(f)
+            with open("bot/published_offers.json", "rb") as f:
+                return orjson.loads(f.read())
         return {}
     except Exception as e:
         logger.error(f"Error cargando historial de ofertas: {str(e)}")
@@ -186,8 +254,12 @@ def load_published_offers():
 def save_published_offer(offer):
     """Guarda una oferta en el historial de publicadas"""
     try:
-        # Cargamos el historial existente
-        published_offers = load_published_offers()
+        # Releemos el historial justo antes de escribir para conservar las entradas que el bot
+        # haya añadido durante la ejecución (si no se puede leer, no escribimos para no vaciarlo)
+        published_offers = {}
+        if os.path.exists("bot/published_offers.json"):
+            with open("bot/published_offers.json", "rb") as f:
+                published_offers = orjson.loads(f.read())
         
         # Generamos un ID único para la oferta basado en el título
         offer_id = generate_offer_id(offer)
@@ -204,8 +276,7 @@ def save_published_offer(offer):
         }
         
         # Guardamos el historial actualizado
-        with open("bot/published_offers.json", "w", encoding="utf-8") as f:
-            json.dump(published_offers, f, ensure_ascii=False, indent=2)
+        write_json_atomic("bot/published_offers.json", published_offers)
         
         logger.info(f"Oferta guardada en el historial: {offer['titulo']}")
         return True
@@ -216,19 +287,44 @@ def save_published_offer(offer):
 def generate_offer_id(offer):
     """Genera un ID único para una oferta basado únicamente en su título"""
     # Usamos solo el título para generar el ID
-    title_clean = ' '.join(offer['titulo'].lower().split())
+    title_clean = normalize_title(offer['titulo'])
     
     # Método simple de hashing para generar un ID corto
-    import hashlib
+    # (MD5 se mantiene para que los IDs coincidan con los ya guardados en el historial)
     hash_object = hashlib.md5(title_clean.encode())
     return f"offer_{hash_object.hexdigest()[:8]}"
 
-def is_offer_already_published(offer, published_offers):
+def normalize_title(title):
+    """Convierte un título a minúsculas y elimina espacios extra"""
+    return ' '.join(title.lower().split())
+
+def build_title_index(published_offers):
+    """Precalcula los títulos normalizados del historial y un índice inverso palabra -> IDs de ofertas"""
+    titles = {}
+    word_index = {}
+    for pub_id, pub_offer in published_offers.items():
+        title = pub_offer.get("title")
+        if not title:
+            continue
+        normalized = normalize_title(title)
+        words = frozenset(normalized.split())
+        titles[pub_id] = (normalized, words)
+        for word in words:
+            word_index.setdefault(word, set()).add(pub_id)
+    return titles, word_index
+
+def is_offer_already_published(offer, published_offers, title_index=None):
     """Verifica si una oferta ya ha sido publicada en el último mes"""
     if not published_offers:
-        logger.info("No hay historial de ofertas publicadas")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("No hay historial de ofertas publicadas")
         return False, None
     
+    # El índice de títulos se puede precalcular una vez por ejecución con build_title_index
+    if title_index is None:
+        title_index = build_title_index(published_offers)
+    titles, word_index = title_index
+    
     # Fecha actual
     current_date = datetime.now()
     
@@ -248,10 +344,12 @@ def is_offer_already_published(offer, published_offers):
             
             # Si han pasado más de 30 días, permitimos volver a publicar
             if days_since_published > 30:
-                logger.info(f"Oferta publicada hace más de un mes ({days_since_published} días), permitiendo republicación: {offer['titulo']}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Oferta publicada hace más de un mes ({days_since_published} días), permitiendo republicación: {offer['titulo']}")
                 return False, offer_id
             
-            logger.info(f"Oferta publicada hace menos de un mes ({days_since_published} días), saltando: {offer['titulo']}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Oferta publicada hace menos de un mes ({days_since_published} días), saltando: {offer['titulo']}")
             return True, offer_id
             
         except (ValueError, KeyError) as e:
@@ -260,18 +358,32 @@ def is_offer_already_published(offer, published_offers):
             return True, offer_id
     
     # También verificamos por similitud en título
-    for pub_id, pub_offer in published_offers.items():
-        # Verificamos solo por similitud en el título
-        if similar_titles(offer["titulo"], pub_offer["title"]):
+    t1 = normalize_title(offer["titulo"])
+    words1 = frozenset(t1.split())
+    
+    # Solo las ofertas con alguna palabra en común pueden coincidir por palabras clave
+    candidates = set().union(*(word_index.get(word, ()) for word in words1))
+    
+    for pub_id, (t2, words2) in titles.items():
+        if pub_id in candidates:
+            similar = similar_tokens(t1, words1, t2, words2)
+        else:
+            # Sin palabras en común solo pueden ser similares si uno contiene al otro
+            similar = t1 in t2 or t2 in t1
+        
+        if similar:
+            pub_offer = published_offers[pub_id]
             try:
                 published_date = datetime.fromisoformat(pub_offer["published_at"].replace('Z', '+00:00'))
                 days_since_published = (current_date - published_date).days
                 
                 if days_since_published > 30:
-                    logger.info(f"Oferta similar publicada hace más de un mes ({days_since_published} días), permitiendo republicación: {offer['titulo']}")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(f"Oferta similar publicada hace más de un mes ({days_since_published} días), permitiendo republicación: {offer['titulo']}")
                     return False, pub_id
                 
-                logger.info(f"Oferta similar publicada hace menos de un mes ({days_since_published} días), saltando: {offer['titulo']}")
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Oferta similar publicada hace menos de un mes ({days_since_published} días), saltando: {offer['titulo']}")
                 return True, pub_id
                 
             except (ValueError, KeyError) as e:
@@ -279,15 +391,19 @@ def is_offer_already_published(offer, published_offers):
                 # Si hay un error con la fecha, asumimos que es reciente
                 return True, pub_id
     
-    logger.info(f"Oferta nueva, no publicada anteriormente: {offer['titulo']}")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Oferta nueva, no publicada anteriormente: {offer['titulo']}")
     return False, None
 
 def similar_titles(title1, title2):
     """Verifica si dos títulos son similares"""
     # Convertimos a minúsculas y eliminamos espacios extra
-    t1 = ' '.join(title1.lower().split())
-    t2 = ' '.join(title2.lower().split())
-    
+    t1 = normalize_title(title1)
+    t2 = normalize_title(title2)
+    return similar_tokens(t1, frozenset(t1.split()), t2, frozenset(t2.split()))
+
+def similar_tokens(t1, words1, t2, words2):
+    """Verifica si dos títulos normalizados son similares usando sus conjuntos de palabras precalculados"""
     # Si son idénticos, son similares
     if t1 == t2:
         return True
@@ -297,8 +413,6 @@ def similar_titles(title1, title2):
         return True
     
     # Verificamos palabras clave comunes (más de 3 palabras en común)
-    words1 = set(t1.split())
-    words2 = set(t2.split())
     common_words = words1.intersection(words2)
     
     # Si hay más de 3 palabras en común y representan más del 50% de las palabras más cortas
@@ -308,18 +422,26 @@ def similar_titles(title1, title2):
     
     return False
 
+def select_first(node, selectors):
+    """Devuelve el primer nodo encontrado respetando el orden de prioridad de los selectores"""
+    for selector in selectors:
+        elem = node.css_first(selector)
+        if elem:
+            return elem
+    return None
+
 def extract_offer(card, product_id=None):
     """Extrae datos de un producto con manejo robusto de errores"""
     try:
         # Extraemos el título y enlace
-        title_elem = card.select_one("a.poly-component__title") or card.select_one("h2.ui-search-item__title a")
+        title_elem = select_first(card, ("a.poly-component__title", "h2.ui-search-item__title a"))
         
         if not title_elem:
             logger.warning(f"Selector no encontrado: título (Producto ID: {product_id})")
             return None
         
-        title = title_elem.text.strip()
-        raw_link = title_elem.get("href", "")
+        title = title_elem.text().strip()
+        raw_link = title_elem.attributes.get("href") or ""
         
         if not raw_link:
             logger.warning(f"Enlace no encontrado para: {title}")
@@ -334,42 +456,43 @@ def extract_offer(card, product_id=None):
         
         # Extraemos los precios
         # Precio actual
-        price_current_elem = (
-            card.select_one("div.poly-component__price div.poly-price__current span.andes-money-amount__fraction") or
-            card.select_one("span.andes-money-amount__fraction") or
-            card.select_one("span.price-tag-fraction")
-        )
+        price_current_elem = select_first(card, (
+            "div.poly-component__price div.poly-price__current span.andes-money-amount__fraction",
+            "span.andes-money-amount__fraction",
+            "span.price-tag-fraction"
+        ))
         
         if not price_current_elem:
             logger.warning(f"Selector no encontrado: precio_actual (Producto: {title})")
             return None
         
         try:
-            current_price = int(price_current_elem.text.replace(".", "").replace(",", ""))
+            current_price = int(price_current_elem.text().replace(".", "").replace(",", ""))
         except ValueError:
-            logger.warning(f"No se pudo convertir el precio actual a entero: {price_current_elem.text} (Producto: {title})")
+            logger.warning(f"No se pudo convertir el precio actual a entero: {price_current_elem.text()} (Producto: {title})")
             return None
         
         # Precio original
-        price_original_elem = (
-            card.select_one("span.andes-money-amount__fraction") or
-            card.select_one("span.ui-search-price__original-value span.andes-money-amount__fraction") or
-            card.select_one("span.price-tag-original-value")
-        )
+        price_original_elem = select_first(card, (
+            "span.andes-money-amount__fraction",
+            "span.ui-search-price__original-value span.andes-money-amount__fraction",
+            "span.price-tag-original-value"
+        ))
         
         if not price_original_elem:
             logger.warning(f"Selector no encontrado: precio_original (Producto: {title})")
             return None
         
         try:
-            original_price = int(price_original_elem.text.replace(".", "").replace(",", ""))
+            original_price = int(price_original_elem.text().replace(".", "").replace(",", ""))
         except ValueError:
-            logger.warning(f"No se pudo convertir el precio original a entero: {price_original_elem.text} (Producto: {title})")
+            logger.warning(f"No se pudo convertir el precio original a entero: {price_original_elem.text()} (Producto: {title})")
             return None
         
         # Verificamos que sea una oferta real
         if original_price <= current_price:
-            logger.debug(f"No es una oferta real: {title} ({current_price} >= {original_price})")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"No es una oferta real: {title} ({current_price} >= {original_price})")
             return None
         
         # Calculamos el descuento
@@ -377,15 +500,16 @@ def extract_offer(card, product_id=None):
         
         # Solo consideramos ofertas con descuento >= 30%
         if discount < 30:
-            logger.debug(f"Descuento insuficiente: {title} ({discount}%)")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Descuento insuficiente: {title} ({discount}%)")
             return None
         
         # Extraemos la imagen
-        img_elem = (
-            card.select_one("div.poly-card__portada img.poly-component__picture") or
-            card.select_one("img.ui-search-result-image__element") or
-            card.select_one("img[class*='ui-search-result-image']")
-        )
+        img_elem = select_first(card, (
+            "div.poly-card__portada img.poly-component__picture",
+            "img.ui-search-result-image__element",
+            "img[class*='ui-search-result-image']"
+        ))
         
         # Obtenemos la URL real de la imagen (evitando placeholders)
         image_url = get_real_image_url(img_elem)
@@ -396,16 +520,17 @@ def extract_offer(card, product_id=None):
         
         # Extraemos la cantidad de vendidos
         sold = 0
-        sold_elem = (
-            card.select_one("span.poly-component__sold") or
-            card.select_one("span.ui-search-item__group__element") or
-            card.select_one("span[class*='ui-search-item__highlight-label']")
-        )
-        
-        if sold_elem and ("vendido" in sold_elem.text.lower() or "vendidos" in sold_elem.text.lower()):
-            sold = extract_number(sold_elem.text)
-        else:
-            logger.info(f"Información de vendidos no encontrada para: {title}. Usando 0.")
+        sold_elem = select_first(card, (
+            "span.poly-component__sold",
+            "span.ui-search-item__group__element",
+            "span[class*='ui-search-item__highlight-label']"
+        ))
+        sold_text = sold_elem.text() if sold_elem else ""
+        
+        if sold_text and ("vendido" in sold_text.lower() or "vendidos" in sold_text.lower()):
+            sold = extract_number(sold_text)
+        elif logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Información de vendidos no encontrada para: {title}. Usando 0.")
         
         # Creamos y devolvemos el objeto de oferta
         return {
@@ -427,17 +552,53 @@ def extract_offer(card, product_id=None):
             if not os.path.exists(debug_dir):
                 os.makedirs(debug_dir)
             with open(f"{debug_dir}/debug_product_{datetime.now().strftime('%Y%m%d_%H%M%S')}.html", "w", encoding="utf-8") as f:
-                f.write(str(card))
+                f.write(card.html or "")
         except Exception as debug_error:
             logger.error(f"Error guardando HTML de debug: {str(debug_error)}")
         return None
 
+def score_offer(offer):
+    """Calcula el score de una oferta (descuento * vendidos)"""
+    discount = offer["descuento"]
+    sold = offer["vendidos"]
+    
+    # Fórmula de scoring: descuento * (vendidos + 1)
+    # Con bonificaciones para ofertas con alto descuento y muchas ventas
+    discount_multiplier = 1.5 if discount >= 50 else 1.0
+    sales_multiplier = 1.5 if sold >= 100 else (1.2 if sold >= 50 else 1.0)
+    
+    return discount * discount_multiplier * (sold + 1) * sales_multiplier
+
+# Limita las peticiones simultáneas a Mercado Libre para evitar bloqueos
+FETCH_SEMAPHORE = Semaphore(2)
+
+def fetch_with_retries(url):
+    """Descarga una página de listado con reintentos, devuelve None si fallan todos"""
+    with FETCH_SEMAPHORE:
+        logger.info(f"Scrapeando URL: {url}")
+        
+        for attempt in range(3):
+            try:
+                headers = get_random_headers()
+                response = SESSION.get(url, headers=headers, timeout=15)
+                response.raise_for_status()
+                return response
+            except (requests.RequestException, Exception) as e:
+                logger.error(f"Error en intento {attempt+1}/3: {str(e)}")
+                if attempt == 2:  # Si es el último intento
+                    logger.error(f"Fallaron todos los intentos para {url}. Pasando a la siguiente URL.")
+                    break
+                time.sleep(random.uniform(2, 5))
+        
+        return None
+
 def scrape_mercado_libre():
     """Función principal para scrapear Mercado Libre con manejo robusto de errores"""
     logger.info("Iniciando scraping de Mercado Libre...")
     
     # Cargamos el historial de ofertas publicadas
     published_offers = load_published_offers()
+    title_index = build_title_index(published_offers)
     logger.info(f"Historial de ofertas cargado: {len(published_offers)} ofertas publicadas anteriormente")
     
     # URLs de ofertas de tecnología (con filtros de descuento)
@@ -453,49 +614,37 @@ def scrape_mercado_libre():
     total_products_analyzed = 0
     
     try:
-        for url in urls:
-            logger.info(f"Scrapeando URL: {url}")
-            
-            # Realizamos la petición con reintentos
-            response = None
-            for attempt in range(3):
-                try:
-                    headers = get_random_headers()
-                    response = requests.get(url, headers=headers, timeout=15)
-                    response.raise_for_status()
-                    break
-                except (requests.RequestException, Exception) as e:
-                    logger.error(f"Error en intento {attempt+1}/3: {str(e)}")
-                    if attempt == 2:  # Si es el último intento
-                        logger.error(f"Fallaron todos los intentos para {url}. Pasando a la siguiente URL.")
-                        break
-                    time.sleep(random.uniform(2, 5))
-            
+        # Descargamos las páginas en paralelo; el procesamiento se mantiene en el orden de las URLs
+        with ThreadPoolExecutor(max_workers=len(urls)) as executor:
+            responses = list(executor.map(fetch_with_retries, urls))
+        
+        for url, response in zip(urls, responses):
             if not response:
                 continue
             
-            # Parseamos el HTML
-            soup = BeautifulSoup(response.text, "lxml")
+            # Parseamos el HTML directamente desde los bytes (Mercado Libre sirve UTF-8),
+            # evitando la detección de charset y la decodificación de response.text
+            tree = LexborHTMLParser(response.content)
             
             # Buscamos el contenedor principal con la nueva estructura
-            main_container = soup.select_one("div.items-with-smart-groups")
+            main_container = tree.css_first("div.items-with-smart-groups")
             
             if not main_container:
                 logger.warning(f"No se encontró el contenedor principal en {url}. Probando selectores alternativos.")
                 # Intentamos con selectores alternativos
-                main_container = soup.select_one("div.ui-search-results") or soup.select_one("section.items_container")
+                main_container = tree.css_first("div.ui-search-results") or tree.css_first("section.items_container")
                 
                 if not main_container:
                     logger.error(f"No se pudo encontrar ningún contenedor de productos en {url}")
                     continue
             
             # Buscamos las tarjetas de productos con la nueva estructura
-            product_cards = main_container.select("div.poly-card") or main_container.select("li.ui-search-layout__item")
+            product_cards = main_container.css("div.poly-card") or main_container.css("li.ui-search-layout__item")
             
             if not product_cards:
                 logger.warning(f"No se encontraron tarjetas de productos en {url}. Probando selectores alternativos.")
                 # Intentamos con selectores alternativos
-                product_cards = main_container.select("div[class*='promotion-item']") or main_container.select("div[class*='ui-search-result']")
+                product_cards = main_container.css("div[class*='promotion-item']") or main_container.css("div[class*='ui-search-result']")
                 
                 if not product_cards:
                     logger.error(f"No se pudo encontrar ninguna tarjeta de producto en {url}")
@@ -515,17 +664,13 @@ def scrape_mercado_libre():
                     continue
                 
                 # Verificamos si la oferta ya ha sido publicada en el último mes
-                is_published, _ = is_offer_already_published(offer, published_offers)
+                is_published, _ = is_offer_already_published(offer, published_offers, title_index)
                 
                 if is_published:
-                    logger.info(f"Oferta ya publicada en el último mes, saltando: {offer['titulo']}")
                     continue
                 
                 # Añadimos la oferta a la lista de ofertas válidas
                 valid_offers.append(offer)
-            
-            # Esperamos un tiempo aleatorio entre peticiones para evitar bloqueos
-            time.sleep(random.uniform(2, 5))
         
         # Resumen de la ejecución
         logger.info(f"Análisis completado: {total_products_analyzed} productos analizados, {len(valid_offers)} ofertas válidas encontradas")
@@ -533,26 +678,15 @@ def scrape_mercado_libre():
         if not valid_offers:
             logger.warning("❌ No se encontraron ofertas válidas que no hayan sido publicadas anteriormente")
             # Creamos un archivo vacío para evitar errores en el bot
-            with open("scraper/ofertas.json", "w", encoding="utf-8") as f:
-                json.dump([], f)
+            write_json_atomic("scraper/ofertas.json", [])
             return
         
-        # Ordenamos las ofertas por score (descuento * vendidos)
-        scored_offers = []
-        for offer in valid_offers:
-            discount = offer["descuento"]
-            sold = offer["vendidos"]
-            
-            # Fórmula de scoring: descuento * (vendidos + 1)
-            # Con bonificaciones para ofertas con alto descuento y muchas ventas
-            discount_multiplier = 1.5 if discount >= 50 else 1.0
-            sales_multiplier = 1.5 if sold >= 100 else (1.2 if sold >= 50 else 1.0)
-            
-            score = discount * discount_multiplier * (sold + 1) * sales_multiplier
-            scored_offers.append((offer, score))
-        
-        # Ordenamos por score de mayor a menor
-        scored_offers.sort(key=lambda x: x[1], reverse=True)
+        # Solo necesitamos las dos mejores ofertas por score (la segunda como alternativa)
+        scored_offers = heapq.nlargest(
+            2,
+            ((offer, score_offer(offer)) for offer in valid_offers),
+            key=lambda x: x[1]
+        )
         
         # Tomamos la mejor oferta
         best_offer = scored_offers[0][0]
@@ -574,19 +708,18 @@ def scrape_mercado_libre():
                 logger.info(f"Usando oferta alternativa: {best_offer['titulo']} - Score: {best_score}")
             else:
                 # No hay ofertas alternativas
-                with open("scraper/ofertas.json", "w", encoding="utf-8") as f:
-                    json.dump([], f)
+                write_json_atomic("scraper/ofertas.json", [])
                 logger.warning("No se guardó ninguna oferta debido a imágenes inválidas")
                 return
         
+        # Guardamos la oferta en el historial de publicadas antes de escribir ofertas.json,
+        # para que el bot siempre encuentre el historial actualizado
+        save_published_offer(best_offer)
+        
         # Guardamos la mejor oferta en el archivo JSON
-        with open("scraper/ofertas.json", "w", encoding="utf-8") as f:
-            json.dump([best_offer], f, ensure_ascii=False, indent=2)
+        write_json_atomic("scraper/ofertas.json", [best_offer])
         logger.info(f"✅ Oferta guardada exitosamente: {best_offer['titulo']} - Descuento: {best_offer['descuento']}%")
         
-        # Guardamos la oferta en el historial de publicadas
-        save_published_offer(best_offer)
-        
         # Llamamos al generador de links de afiliados
         try:
             logger.info("Iniciando generador de links de afiliados...")
@@ -607,8 +740,7 @@ def scrape_mercado_libre():
         logger.error(traceback.format_exc())
         # Aseguramos que el archivo exista para evitar errores en el bot
         if not os.path.exists("scraper/ofertas.json"):
-            with open("scraper/ofertas.json", "w", encoding="utf-8") as f:
-                json.dump([], f)
+            write_json_atomic("scraper/ofertas.json", [])
 
 def run_scraper():
     """Ejecuta el scraper y maneja excepciones"""
@@ -620,6 +752,18 @@ def run_scraper():
         import traceback
         logger.error(traceback.format_exc())
 
+# Horas del día en las que se ejecuta el scraper (cada 8 horas)
+SCHEDULE_HOURS = (0, 8, 16)
+
+def get_next_run_time(now):
+    """Calcula la próxima hora programada de ejecución a partir de now"""
+    today_runs = [now.replace(hour=hour, minute=0, second=0, microsecond=0) for hour in SCHEDULE_HOURS]
+    upcoming = [run_time for run_time in today_runs if run_time > now]
+    if upcoming:
+        return min(upcoming)
+    # Si ya pasaron todas las de hoy, la próxima es la primera de mañana
+    return min(today_runs) + timedelta(days=1)
+
 def main():
     """Función principal que configura la ejecución programada"""
     logger.info("Iniciando el scraper de Mercado Libre")
@@ -627,18 +771,18 @@ def main():
     # Ejecutamos inmediatamente al iniciar
     run_scraper()
     
-    # Programamos ejecuciones cada 8 horas (00:00, 08:00, 16:00)
-    schedule.every().day.at("00:00").do(run_scraper)
-    schedule.every().day.at("08:00").do(run_scraper)
-    schedule.every().day.at("16:00").do(run_scraper)
-    
-    logger.info("Scraper programado para ejecutarse cada 8 horas (00:00, 08:00, 16:00)")
+    schedule_times = ", ".join(f"{hour:02d}:00" for hour in SCHEDULE_HOURS)
+    logger.info(f"Scraper programado para ejecutarse a diario a las {schedule_times}")
     
-    # Bucle principal
+    # Bucle principal: dormimos directamente hasta la próxima ejecución programada
     try:
         while True:
-            schedule.run_pending()
-            time.sleep(60)  # Verificamos cada minuto
+            next_run = get_next_run_time(datetime.now())
+            logger.info(f"Próxima ejecución programada: {next_run.strftime('%Y-%m-%d %H:%M')}")
+            # Volcamos a disco los mensajes acumulados antes de dormir hasta la próxima ejecución
+            BUFFERED_FILE_HANDLER.flush()
+            time.sleep(max(0, (next_run - datetime.now()).total_seconds()))
+            run_scraper()
     except KeyboardInterrupt:
         logger.info("Scraper detenido manualmente")
     except Exception as e: